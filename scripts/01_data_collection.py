@@ -8,10 +8,12 @@ Works with newer yfinance versions (handles MultiIndex columns + Date/Datetime).
 """
 
 import getpass
+import io
+from functools import reduce
 import pandas as pd
+import requests_cache
 import yfinance as yf
 import psycopg2
-from psycopg2.extras import execute_values
 
 # -------------------------------
 # DB CONFIG
@@ -45,24 +47,72 @@ def get_metal_map(conn):
     return {sym: {"id": mid, "ticker": tkr} for sym, mid, tkr in rows}
 
 
-def _flatten_yfinance_columns(df: pd.DataFrame) -> pd.DataFrame:
+MACRO_TICKERS = {
+    "DX-Y.NYB": "usd_index",
+    "^VIX": "vix",
+    "^TNX": "treasury_yield_10y",
+    "^GSPC": "sp500_close",
+}
+
+
+def fetch_all_history(tickers, start="2020-01-01", end="2025-12-31"):
+    """
+    One batched yfinance call for every ticker (metals + macro).
+    yfinance threads the HTTP requests internally, so this overlaps
+    all the network latency instead of paying it per ticker.
+
+    Responses are cached in a local SQLite file for an hour, so
+    re-running the script (e.g. after a DB hiccup) reads from disk
+    instead of re-downloading six years of history from Yahoo.
+    """
+    session = requests_cache.CachedSession("yf_cache", expire_after=3600)
+    data = yf.download(
+        list(tickers),
+        start=start,
+        end=end,
+        progress=False,
+        auto_adjust=False,
+        group_by="ticker",
+        threads=True,
+        session=session,
+    )
+    if data is None or data.empty:
+        raise RuntimeError("yfinance returned no data for batch download.")
+    return data
+
+
+def _to_date_column(s: pd.Series) -> pd.Series:
+    """
+    yfinance hands back a datetime64 index, so the normal case is a
+    direct .dt.date with no parsing at all. The fallback pins the
+    format so pandas stays on its C fast path instead of dateutil
+    guessing per cell.
     """
-    yfinance can return MultiIndex columns like ('Open','GC=F').
-    This flattens them to 'Open', 'High', etc.
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s.dt.date
+    return pd.to_datetime(s, format="%Y-%m-%d", errors="raise").dt.date
+
+
+def _slice_ticker(data: pd.DataFrame, ticker: str):
     """
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = [c[0] for c in df.columns]
+    Pull one ticker's OHLCV out of the batched MultiIndex frame.
+    Falls back to the frame itself if yfinance returned a flat frame
+    (happens when only one ticker was requested).
+    """
+    if isinstance(data.columns, pd.MultiIndex):
+        if ticker not in data.columns.get_level_values(0):
+            return None
+        df = data[ticker].copy()
+    else:
+        df = data.copy()
     return df
 
 
-def download_prices(ticker, start="2020-01-01", end="2025-12-31"):
-    # Force stable output
-    df = yf.download(ticker, start=start, end=end, progress=False, auto_adjust=False)
+def download_prices(data, ticker):
+    df = _slice_ticker(data, ticker)
     if df is None or df.empty:
         return None
 
-    df = _flatten_yfinance_columns(df)
-
     # Turn index into a column
     df = df.reset_index()
 
@@ -103,7 +153,7 @@ def download_prices(ticker, start="2020-01-01", end="2025-12-31"):
         if r not in df.columns:
             raise RuntimeError(f"yfinance output missing column '{r}'. Columns found: {list(df.columns)}")
 
-    df["date"] = pd.to_datetime(df["date"]).dt.date
+    df["date"] = _to_date_column(df["date"])
 
     keep = ["date", "open", "high", "low", "close", "volume", "adjusted_close"]
     df = df[keep].dropna(subset=["date", "open", "high", "low", "close"])
@@ -116,48 +166,40 @@ def insert_price_data(conn, metal_id, df):
         print("⚠ No price data returned.")
         return 0
 
-    records = []
-    for _, r in df.iterrows():
-        records.append((
-            metal_id,
-            r["date"],
-            float(r["open"]),
-            float(r["high"]),
-            float(r["low"]),
-            float(r["close"]),
-            None if pd.isna(r["volume"]) else int(r["volume"]),
-            None if pd.isna(r["adjusted_close"]) else float(r["adjusted_close"]),
-            "yfinance"
-        ))
-
-    sql = """
-    INSERT INTO price_data
-      (metal_id, date, open, high, low, close, volume, adjusted_close, data_source)
-    VALUES %s
-    ON CONFLICT (metal_id, date) DO NOTHING;
-    """
+    # COPY into a temp staging table, then upsert from it. COPY skips the
+    # per-row SQL parse cost entirely and has no parameter-count limit.
+    out = df[["date", "open", "high", "low", "close", "volume", "adjusted_close"]].copy()
+    out.insert(0, "metal_id", metal_id)
+    out["volume"] = out["volume"].astype("Int64")  # keep CSV ints, NaN -> ''
+    out["data_source"] = "yfinance"
 
-    with conn.cursor() as cur:
-        execute_values(cur, sql, records, page_size=2000)
+    buf = io.StringIO()
+    out.to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
 
-    return len(records)
+    cols = "metal_id, date, open, high, low, close, volume, adjusted_close, data_source"
+    with conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE stg_price (LIKE price_data INCLUDING DEFAULTS) ON COMMIT DROP;")
+        cur.copy_expert(f"COPY stg_price ({cols}) FROM STDIN WITH CSV NULL ''", buf)
+        cur.execute(f"""
+            INSERT INTO price_data ({cols})
+            SELECT {cols} FROM stg_price
+            ON CONFLICT (metal_id, date) DO NOTHING;
+        """)
+        # All metals share one transaction now, so drop the staging table
+        # explicitly instead of relying on ON COMMIT DROP
+        cur.execute("DROP TABLE stg_price;")
 
+    return len(out)
 
-def download_macro(start="2020-01-01", end="2025-12-31"):
-    tickers = {
-        "DX-Y.NYB": "usd_index",
-        "^VIX": "vix",
-        "^TNX": "treasury_yield_10y",
-        "^GSPC": "sp500_close",
-    }
 
+def download_macro(data):
     frames = []
-    for tkr, col in tickers.items():
-        df = yf.download(tkr, start=start, end=end, progress=False, auto_adjust=False)
+    for tkr, col in MACRO_TICKERS.items():
+        df = _slice_ticker(data, tkr)
         if df is None or df.empty:
             raise RuntimeError(f"No macro data returned for {tkr}")
 
-        df = _flatten_yfinance_columns(df)
         df = df.reset_index()
 
         if "Date" in df.columns:
@@ -177,15 +219,20 @@ def download_macro(start="2020-01-01", end="2025-12-31"):
 
         frames.append(df)
 
-    macro = frames[0]
-    for f in frames[1:]:
-        macro = macro.merge(f, on="date", how="outer")
-
-    macro = macro.sort_values("date").ffill()
+    # merge_ordered is built for time-series joins: it keeps the date
+    # order while merging, so no separate sort pass is needed. Its
+    # fill_method only covers gaps introduced by the merge itself, not
+    # NaNs already present in a series (e.g. ^TNX on bond-market
+    # holidays), so a frame-wide ffill is still required before dropna.
+    macro = reduce(
+        lambda left, right: pd.merge_ordered(left, right, on="date", how="outer", fill_method="ffill"),
+        frames,
+    )
+    macro = macro.ffill()
     macro["sp500_return"] = macro["sp500_close"].pct_change()
     macro = macro.dropna(subset=["usd_index", "vix", "treasury_yield_10y", "sp500_close", "sp500_return"])
 
-    macro["date"] = pd.to_datetime(macro["date"]).dt.date
+    macro["date"] = _to_date_column(macro["date"])
     return macro
 
 
@@ -194,29 +241,26 @@ def insert_macro(conn, df):
         print("⚠ No macro data returned.")
         return 0
 
-    records = []
-    for _, r in df.iterrows():
-        records.append((
-            r["date"],
-            float(r["usd_index"]),
-            float(r["vix"]),
-            float(r["treasury_yield_10y"]),
-            float(r["sp500_close"]),
-            float(r["sp500_return"]),
-            "yfinance"
-        ))
-
-    sql = """
-    INSERT INTO macroeconomic_data
-      (date, usd_index, vix, treasury_yield_10y, sp500_close, sp500_return, data_source)
-    VALUES %s
-    ON CONFLICT (date) DO NOTHING;
-    """
+    # Same COPY staging pattern as insert_price_data
+    out = df[["date", "usd_index", "vix", "treasury_yield_10y", "sp500_close", "sp500_return"]].copy()
+    out["data_source"] = "yfinance"
 
+    buf = io.StringIO()
+    out.to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
+
+    cols = "date, usd_index, vix, treasury_yield_10y, sp500_close, sp500_return, data_source"
     with conn.cursor() as cur:
-        execute_values(cur, sql, records, page_size=2000)
+        cur.execute("CREATE TEMP TABLE stg_macro (LIKE macroeconomic_data INCLUDING DEFAULTS) ON COMMIT DROP;")
+        cur.copy_expert(f"COPY stg_macro ({cols}) FROM STDIN WITH CSV NULL ''", buf)
+        cur.execute(f"""
+            INSERT INTO macroeconomic_data ({cols})
+            SELECT {cols} FROM stg_macro
+            ON CONFLICT (date) DO NOTHING;
+        """)
+        cur.execute("DROP TABLE stg_macro;")
 
-    return len(records)
+    return len(out)
 
 
 def verify_counts(conn):
@@ -255,22 +299,30 @@ def main():
         conn = connect_db()
         metal_map = get_metal_map(conn)
 
+        # One batched download for metals + macro instead of 7 serial calls
+        metal_tickers = [metal_map[sym]["ticker"] for sym in ["GOLD", "SILVER", "COPPER"]]
+        all_tickers = metal_tickers + list(MACRO_TICKERS)
+        print(f"\n--- Downloading {len(all_tickers)} tickers in one batch ---")
+        data = fetch_all_history(all_tickers)
+
         for sym in ["GOLD", "SILVER", "COPPER"]:
             mid = metal_map[sym]["id"]
             tkr = metal_map[sym]["ticker"]
 
             print(f"\n--- {sym} ({tkr}) ---")
-            df_prices = download_prices(tkr)
+            df_prices = download_prices(data, tkr)
             n = insert_price_data(conn, mid, df_prices)
-            conn.commit()
             print(f"✓ Insert attempted: {n} rows (duplicates ignored)")
 
         print("\n--- MACRO (DXY, VIX, TNX, S&P500) ---")
-        df_macro = download_macro()
+        df_macro = download_macro(data)
         n = insert_macro(conn, df_macro)
-        conn.commit()
         print(f"✓ Insert attempted: {n} rows (duplicates ignored)")
 
+        # One commit for the whole run: fewer WAL flushes, and a failure
+        # anywhere rolls back cleanly to the pre-run state
+        conn.commit()
+
         verify_counts(conn)
         print("\n✓ DONE.")
 
